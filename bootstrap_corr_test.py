@@ -1,23 +1,31 @@
 import click
 import numpy as np
 import torch
-from scipy.stats import pearsonr
 from torch.utils.data import Subset
 from torch_geometric.loader import DataLoader
 from tqdm import tqdm
 
+from correlation_analysis import pearson
 from dialog_rating_dataset import DialogRatingDataset
 from model.dialog_rater import DialogRater
 from model_manager import MultiDimensionMSELoss
-from utils import get_torch_device
+from utils import get_torch_device, load_model_state_dict
 
 
 @click.command()
 @click.option("--epoch", default=1, type=int)
 @click.option("--variant", default="", type=str)
 @click.option("--n_iterations", default=100, type=int)
-def main(epoch, variant, n_iterations, n_layers=10, graph_out_dim=10):
-    model_name = f"n_layers={n_layers}_graph_out_dim={graph_out_dim}_epoch={epoch}.pth"
+@click.option(
+    "--lora",
+    is_flag=True,
+    help="Fine-tune LoRA adapters on a frozen encoder from an adapter-only checkpoint",
+)
+def main(epoch, variant, n_iterations, lora, n_layers=10, graph_out_dim=10):
+    suffix = "_lora" if lora else ""
+    model_name = (
+        f"n_layers={n_layers}_graph_out_dim={graph_out_dim}{suffix}_epoch={epoch}.pth"
+    )
     dataset_name = "ratings"
     root = f"data/{dataset_name}"
     dataset = DialogRatingDataset(root=root, dataset=dataset_name)
@@ -54,11 +62,16 @@ def main(epoch, variant, n_iterations, n_layers=10, graph_out_dim=10):
             graph_out_dim=graph_out_dim,
             n_hidden_layers=2,
             hidden_dim=128,
+            use_lora=lora,
         )
-        model.graph_embed.load_state_dict(graph_embed_state_dict)
+        # Adapter-only checkpoints hold no base encoder weights, those come from
+        # the shared pre-trained encoder
+        load_model_state_dict(model.graph_embed, graph_embed_state_dict, lora)
         model.to(device)
 
-        optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+        optimizer = torch.optim.Adam(
+            [p for p in model.parameters() if p.requires_grad], lr=lr
+        )
 
         for epoch in range(epochs):
             model.train()
@@ -88,13 +101,10 @@ def main(epoch, variant, n_iterations, n_layers=10, graph_out_dim=10):
             ys = torch.cat(ys, dim=0)
             y_preds = torch.cat(y_preds, dim=0)
 
-            bootstrap_corrs = []
-            for dim_idx in range(y_preds.shape[1]):
-                bootstrap_corrs.append(
-                    pearsonr(y_preds[:, dim_idx].cpu(), ys[:, dim_idx].cpu())[0]
-                )
-
-            dim_corrs.append(bootstrap_corrs)
+            bootstrap_corrs = pearson(
+                y_preds.cpu().double().numpy(), ys.cpu().double().numpy()
+            )
+            dim_corrs.append(bootstrap_corrs.tolist())
 
     torch.save(dim_corrs, f"bootstrap_results/corrs{variant}.pt")
 
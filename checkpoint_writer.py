@@ -0,0 +1,90 @@
+import os
+import queue
+import threading
+
+import torch
+
+
+def cpu_state_dict(state_dict):
+    """Copies a state dict to CPU so training can keep updating the live weights."""
+    return {k: v.detach().to("cpu", copy=True) for k, v in state_dict.items()}
+
+
+class CheckpointWriter:
+    """Writes checkpoints from a background thread.
+
+    Checkpoints are written to a temporary file and renamed into place, so an
+    interrupted write never leaves a truncated checkpoint behind. With `keep_last_n`
+    only the newest checkpoints are kept on disk, and with `keep_best` the checkpoint
+    with the lowest reported score is kept as well, or on its own without
+    `keep_last_n`. Checkpoints that have not been scored yet are never removed while
+    `keep_best` is on.
+    """
+
+    def __init__(self, keep_last_n=None, keep_best=False, max_pending=2):
+        self.keep_last_n = keep_last_n
+        self.keep_best = keep_best
+        self.paths = []
+        self.scores = {}
+        self.error = None
+
+        # Bounded so snapshots can't pile up in memory when the disk is slow
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, path, state_dict):
+        self._raise_error()
+        self.queue.put(("save", path, cpu_state_dict(state_dict)))
+
+    def set_score(self, path, score):
+        self._raise_error()
+        self.queue.put(("score", path, score))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError("Writing checkpoint failed") from self.error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue
+
+            op, path, value = item
+            try:
+                if op == "save":
+                    tmp_path = path + ".tmp"
+                    torch.save(value, tmp_path)
+                    os.replace(tmp_path, path)
+                    if path in self.paths:
+                        self.paths.remove(path)
+                    self.paths.append(path)
+                else:
+                    self.scores[path] = value
+                self._prune()
+            except Exception as e:
+                self.error = e
+
+    def _prune(self):
+        if self.keep_last_n is None and not self.keep_best:
+            return
+
+        keep = set(self.paths[-self.keep_last_n :]) if self.keep_last_n else set()
+        if self.keep_best:
+            keep.update(p for p in self.paths if p not in self.scores)
+            scored = [p for p in self.paths if p in self.scores]
+            if scored:
+                keep.add(min(scored, key=self.scores.get))
+
+        for path in self.paths:
+            if path not in keep and os.path.exists(path):
+                os.remove(path)
+        self.paths = [p for p in self.paths if p in keep]
@@ -0,0 +1,248 @@
+import click
+import numpy as np
+import torch
+from scipy.stats import rankdata, ttest_ind
+
+from prediction_log import PredictionLog
+
+DIMENSIONS = ["Tactfulness", "Helpfulness", "Clearness", "Astuteness"]
+
+
+def pearson(x, y):
+    """Pearson correlation along the sample axis of (..., n_samples, n_dims) arrays."""
+    x = x - x.mean(axis=-2, keepdims=True)
+    y = y - y.mean(axis=-2, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (x * y).sum(axis=-2) / np.sqrt((x**2).sum(axis=-2) * (y**2).sum(axis=-2))
+
+
+def spearman(x, y):
+    """Spearman correlation along the sample axis, ties get their average rank."""
+    return pearson(rankdata(x, axis=-2), rankdata(y, axis=-2))
+
+
+def kendall(x, y, max_chunk_elements=2**24):
+    """Kendall's tau-b along the sample axis of (..., n_samples, n_dims) arrays.
+
+    All sample pairs are compared at once, so leading dimensions are processed in
+    chunks to bound the size of the (chunk, n, n, n_dims) sign arrays.
+    """
+    batch_shape = x.shape[:-2]
+    n, d = x.shape[-2:]
+    x = x.reshape(-1, n, d)
+    y = y.reshape(-1, n, d)
+
+    chunk_size = max(1, max_chunk_elements // (n * n * d))
+    taus = []
+    for start in range(0, len(x), chunk_size):
+        x_chunk, y_chunk = x[start : start + chunk_size], y[start : start + chunk_size]
+        x_signs = np.sign(x_chunk[:, :, None, :] - x_chunk[:, None, :, :])
+        y_signs = np.sign(y_chunk[:, :, None, :] - y_chunk[:, None, :, :])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            taus.append(
+                (x_signs * y_signs).sum(axis=(1, 2))
+                / np.sqrt(
+                    np.abs(x_signs).sum(axis=(1, 2)) * np.abs(y_signs).sum(axis=(1, 2))
+                )
+            )
+
+    return np.concatenate(taus).reshape(*batch_shape, d)
+
+
+CORRELATIONS = {"pearson": pearson, "spearman": spearman, "kendall": kendall}
+
+
+def bootstrap_indices(n_samples, n_resamples=1000, seed=None):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, n_samples, size=(n_resamples, n_samples))
+
+
+def bootstrap_correlations(
+    targets, preds, method="pearson", n_resamples=1000, ci=0.95, seed=None, idxs=None
+):
+    """Correlation per dimension with a percentile bootstrap confidence interval.
+
+    All resamples are gathered into one (n_resamples, n_samples, n_dims) array and
+    correlated in a single vectorized call.
+    """
+    corr = CORRELATIONS[method]
+    if idxs is None:
+        idxs = bootstrap_indices(len(targets), n_resamples, seed)
+
+    resampled = corr(targets[idxs], preds[idxs])
+    ci_low, ci_high = np.nanpercentile(
+        resampled, [50 * (1 - ci), 50 * (1 + ci)], axis=0
+    )
+
+    return {
+        "estimate": corr(targets, preds),
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+        "resamples": resampled,
+    }
+
+
+def paired_bootstrap_test(
+    targets, preds_a, preds_b, method="pearson", n_resamples=1000, ci=0.95, seed=None
+):
+    """Tests whether variant a correlates differently with the targets than variant b.
+
+    Both variants are scored on the same resampled items, so `preds_a` and `preds_b`
+    must be predictions for the same eval samples in the same order. The p-value is
+    the two-sided bootstrap p-value of the correlation difference.
+    """
+    idxs = bootstrap_indices(len(targets), n_resamples, seed)
+    a = bootstrap_correlations(targets, preds_a, method, ci=ci, idxs=idxs)
+    b = bootstrap_correlations(targets, preds_b, method, ci=ci, idxs=idxs)
+
+    diffs = a["resamples"] - b["resamples"]
+    ci_low, ci_high = np.nanpercentile(diffs, [50 * (1 - ci), 50 * (1 + ci)], axis=0)
+    p_value = np.minimum(
+        1.0,
+        2 * np.minimum(np.nanmean(diffs <= 0, axis=0), np.nanmean(diffs >= 0, axis=0)),
+    )
+
+    return {
+        "estimate_a": a["estimate"],
+        "estimate_b": b["estimate"],
+        "difference": a["estimate"] - b["estimate"],
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+        "p_value": p_value,
+    }
+
+
+def compare_bootstrap_corrs(corrs_a, corrs_b, ci=0.95):
+    """Compares two bootstrap correlation distributions from `bootstrap_corr_test.py`.
+
+    The runs resample independently, so they are compared with a Welch t-test per
+    dimension instead of a paired test.
+    """
+    t_stat, p_value = ttest_ind(corrs_a, corrs_b, axis=0, equal_var=False)
+    return {
+        "mean_a": corrs_a.mean(axis=0),
+        "mean_b": corrs_b.mean(axis=0),
+        "ci_a": np.percentile(corrs_a, [50 * (1 - ci), 50 * (1 + ci)], axis=0),
+        "ci_b": np.percentile(corrs_b, [50 * (1 - ci), 50 * (1 + ci)], axis=0),
+        "t_stat": t_stat,
+        "p_value": p_value,
+    }
+
+
+def load_predictions(path, epoch=None, split="eval", n_dims=4):
+    """Loads targets and predictions as (n_samples, n_dims) arrays.
+
+    `path` is either an old per-epoch `epoch_data` `.pt` file or the base path of a
+    prediction log written by `ModelManager.train`, in which case `epoch` is required.
+    """
+    if path.endswith(".pt"):
+        epoch_data = torch.load(path)
+    elif epoch is None:
+        raise ValueError(f"An epoch is required to read the prediction log {path}")
+    else:
+        epoch_data = PredictionLog(path).epoch_data(epoch)
+
+    if epoch_data[f"{split}_preds"] is None:
+        raise ValueError(f"{path} has no {split} predictions for epoch {epoch}")
+
+    targets = np.asarray(epoch_data[f"{split}_target"], dtype=np.float64)
+    preds = np.asarray(epoch_data[f"{split}_preds"], dtype=np.float64)
+    return targets.reshape(-1, n_dims), preds.reshape(-1, n_dims)
+
+
+def load_bootstrap_corrs(path):
+    return np.array(torch.load(path), dtype=np.float64)
+
+
+def print_dimensions(name, values, ci_low=None, ci_high=None, p_value=None):
+    print(name)
+    for i, dimension in enumerate(DIMENSIONS[: len(values)]):
+        line = f"  {dimension}: {values[i]:.3f}"
+        if ci_low is not None:
+            line += f" (CI: {ci_low[i]:.3f}, {ci_high[i]:.3f})"
+        if p_value is not None:
+            line += f", p={p_value[i]:.4f}"
+        print(line)
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.argument("path")
+@click.option("--epoch", "epochs", type=int, multiple=True, help="Epochs to analyse")
+@click.option("--method", "methods", multiple=True, default=list(CORRELATIONS))
+@click.option("--n_resamples", default=1000, type=int)
+@click.option("--seed", default=0, type=int)
+def correlations(path, epochs, methods, n_resamples, seed):
+    """Correlations with bootstrap CIs for the epochs of one training run.
+
+    Without `--epoch` every epoch in a prediction log is analysed.
+    """
+    if not epochs:
+        epochs = [None] if path.endswith(".pt") else PredictionLog(path).epochs()
+
+    for epoch in epochs:
+        try:
+            targets, preds = load_predictions(path, epoch)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        idxs = bootstrap_indices(len(targets), n_resamples, seed)
+        for method in methods:
+            result = bootstrap_correlations(targets, preds, method, idxs=idxs)
+            print_dimensions(
+                f"Epoch {epoch}, {method}",
+                result["estimate"],
+                result["ci_low"],
+                result["ci_high"],
+            )
+
+
+@main.command()
+@click.argument("path_a")
+@click.argument("path_b")
+@click.option("--epoch_a", type=int)
+@click.option("--epoch_b", type=int)
+@click.option("--method", "methods", multiple=True, default=list(CORRELATIONS))
+@click.option("--n_resamples", default=1000, type=int)
+@click.option("--seed", default=0, type=int)
+def compare(path_a, path_b, epoch_a, epoch_b, methods, n_resamples, seed):
+    """Paired bootstrap test between two variants or epochs on the same eval split."""
+    try:
+        targets, preds_a = load_predictions(path_a, epoch_a)
+        targets_b, preds_b = load_predictions(path_b, epoch_b)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    if not np.array_equal(targets, targets_b):
+        raise click.UsageError("Both predictions must be for the same eval samples")
+
+    for method in methods:
+        result = paired_bootstrap_test(
+            targets, preds_a, preds_b, method, n_resamples, seed=seed
+        )
+        print_dimensions(
+            f"{method} difference",
+            result["difference"],
+            result["ci_low"],
+            result["ci_high"],
+            result["p_value"],
+        )
+
+
+@main.command()
+@click.argument("corrs_a")
+@click.argument("corrs_b")
+def compare_bootstrap(corrs_a, corrs_b):
+    """Welch t-test between two `bootstrap_corr_test.py` outputs."""
+    result = compare_bootstrap_corrs(
+        load_bootstrap_corrs(corrs_a), load_bootstrap_corrs(corrs_b)
+    )
+    print_dimensions("Mean a", result["mean_a"], *result["ci_a"])
+    print_dimensions("Mean b", result["mean_b"], *result["ci_b"])
+    print_dimensions("t-statistic", result["t_stat"], p_value=result["p_value"])
+
+
+if __name__ == "__main__":
+    main()
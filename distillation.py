@@ -0,0 +1,242 @@
+import copy
+import time
+from statistics import median
+
+import click
+import torch
+from peft import PeftModel
+from torch.utils.data import Subset
+from torch_geometric.data import Data
+from torch_geometric.loader import DataLoader
+from tqdm import tqdm
+
+from correlation_analysis import DIMENSIONS, pearson
+from dialog_discrimination_dataset import DialogDiscriminationDataset
+from dialog_rating_dataset import DialogRatingDataset
+from model.dialog_rater import DialogRater
+from model.utterance_embedding import StaticUtteranceEmbedding, UtteranceEmbedding
+from model_manager import ModelManager, MultiDimensionMSELoss
+from utils import get_torch_device, print_model_parameters
+
+
+def original_dialog(data):
+    """The original conversation of a pre-training pair, the other is augmented.
+
+    Pairs were swapped at random in pre-processing, `y == -1` means `x2` is the
+    original.
+    """
+    if data.y.item() == 1:
+        x, edge_index, edge_attr = data.x1, data.edge_index1, data.edge_attr1
+    else:
+        x, edge_index, edge_attr = data.x2, data.edge_index2, data.edge_attr2
+    return Data(x=x, edge_index=edge_index, edge_attr=edge_attr, num_nodes=x.size(0))
+
+
+def unique_dialogs(datasets):
+    """Conversations of the datasets without repeats, as each is in several pairs."""
+    seen = set()
+    dialogs = []
+    for dataset in datasets:
+        for data in dataset:
+            key = (tuple(data.x.shape), data.x.numpy().tobytes())
+            if key not in seen:
+                seen.add(key)
+                dialogs.append(data)
+    return dialogs
+
+
+def build_teacher(n_layers, graph_out_dim, lora):
+    return DialogRater(
+        n_graph_layers=n_layers,
+        graph_out_dim=graph_out_dim,
+        n_hidden_layers=2,
+        hidden_dim=128,
+        use_lora=lora,
+    )
+
+
+def build_student(teacher, embedding, n_encoder_layers, n_layers, graph_out_dim):
+    if embedding == "static":
+        # Start from the teacher's (possibly fine-tuned) token embeddings
+        token_embeddings = (
+            teacher.graph_embed.embed.model.get_input_embeddings().weight.detach()
+        )
+        utterance_embedding = StaticUtteranceEmbedding(
+            embed_dim=384, token_embeddings=token_embeddings.cpu().clone()
+        )
+    else:
+        utterance_embedding = UtteranceEmbedding(
+            embed_dim=384, n_encoder_layers=n_encoder_layers
+        )
+        # Start from the teacher's embeddings and first encoder layers
+        teacher_encoder = teacher.graph_embed.embed.model
+        if isinstance(teacher_encoder, PeftModel):
+            teacher_encoder = copy.deepcopy(teacher_encoder).merge_and_unload()
+        student_encoder = utterance_embedding.model
+        student_encoder.embeddings.load_state_dict(
+            teacher_encoder.embeddings.state_dict()
+        )
+        for student_layer, teacher_layer in zip(
+            student_encoder.encoder.layer, teacher_encoder.encoder.layer
+        ):
+            student_layer.load_state_dict(teacher_layer.state_dict())
+
+    return DialogRater(
+        n_graph_layers=n_layers,
+        graph_out_dim=graph_out_dim,
+        n_hidden_layers=2,
+        hidden_dim=128,
+        utterance_embedding=utterance_embedding,
+    )
+
+
+def teacher_labels(teacher, loader, device):
+    """Scores unlabeled conversations with the teacher to use as soft targets."""
+    teacher.eval()
+    data_list = []
+    with torch.no_grad():
+        for batch in tqdm(loader, desc="Teacher labels"):
+            dialogs = batch.to_data_list()
+            out = teacher(batch.to(device)).cpu()
+            for dialog, y in zip(dialogs, out):
+                dialog.y = y
+                data_list.append(dialog)
+    return data_list
+
+
+def timed_eval(model, batches, n_runs=3):
+    """CPU predictions and the median time of `n_runs` passes after a warm-up pass.
+
+    Only the forward passes are timed, the batches are collated beforehand.
+    """
+    model.to("cpu")
+    model.eval()
+    times = []
+    with torch.no_grad():
+        preds = torch.cat([model(batch) for batch in batches])
+        for _ in range(n_runs):
+            start = time.perf_counter()
+            for batch in batches:
+                model(batch)
+            times.append(time.perf_counter() - start)
+    return preds.numpy(), median(times)
+
+
+@click.command()
+@click.option("--teacher", required=True, help="DialogRater state dict to distill")
+@click.option("--teacher_n_layers", default=10, type=int)
+@click.option("--teacher_graph_out_dim", default=10, type=int)
+@click.option("--teacher_lora", is_flag=True, help="Teacher is an adapter checkpoint")
+@click.option("--embedding", type=click.Choice(["static", "shallow"]), default="static")
+@click.option(
+    "--n_encoder_layers", default=2, type=int, help="Encoder layers if shallow"
+)
+@click.option("--n_layers", default=1, type=int, help="Student GNN layers")
+@click.option("--graph_out_dim", default=10, type=int, help="Student graph out dim")
+@click.option("--lr", default=0.001, help="Learning rate")
+@click.option("--epochs", default=5, help="Number of epochs")
+@click.option("--batch_size", default=25, help="Batch size")
+@click.option("--n_training_points", type=int, help="Number of training points")
+@click.option(
+    "--n_timing_runs", default=3, help="Timed CPU passes per model for the speedup"
+)
+@click.option(
+    "--min_teacher_r",
+    default=0.1,
+    help="Smallest teacher |r| to report the correlation retained for",
+)
+def main(
+    teacher,
+    teacher_n_layers,
+    teacher_graph_out_dim,
+    teacher_lora,
+    embedding,
+    n_encoder_layers,
+    n_layers,
+    graph_out_dim,
+    lr,
+    epochs,
+    batch_size,
+    n_training_points,
+    n_timing_runs,
+    min_teacher_r,
+):
+    device = get_torch_device()
+    student_name = (
+        f"student_{embedding}_n_layers={n_layers}_graph_out_dim={graph_out_dim}.pth"
+    )
+
+    teacher_model = build_teacher(teacher_n_layers, teacher_graph_out_dim, teacher_lora)
+    ModelManager(teacher_model, None, device=device, adapter_only=teacher_lora).load(
+        teacher
+    )
+    teacher_model.to(device)
+
+    student = build_student(
+        teacher_model, embedding, n_encoder_layers, n_layers, graph_out_dim
+    )
+    student.to(device)
+    print_model_parameters(student)
+
+    # Soft targets on the original, unlabeled pre-training conversations. The pairs
+    # were shuffled before the train/test split, so the same conversation is in both
+    # splits and the unique ones are split again here.
+    dataset = "twitter_cs"
+    root = f"data/{dataset}"
+    dialogs = unique_dialogs(
+        DialogDiscriminationDataset(
+            root=root, dataset=dataset, split=split, transform=original_dialog
+        )
+        for split in ["train", "test"]
+    )
+    split_idx = int(0.95 * len(dialogs))
+    splits = {}
+    for split, data in [("train", dialogs[:split_idx]), ("test", dialogs[split_idx:])]:
+        data = data[:n_training_points] if n_training_points else data
+        splits[split] = teacher_labels(
+            teacher_model, DataLoader(data, batch_size=batch_size), device
+        )
+
+    optimizer = torch.optim.Adam(student.parameters(), lr=lr)
+    manager = ModelManager(
+        student,
+        optimizer,
+        "ckpts/" + student_name,
+        criterion=MultiDimensionMSELoss(num_classes=4),
+        device=device,
+    )
+    manager.train(
+        train_loader=DataLoader(splits["train"], batch_size=batch_size, shuffle=True),
+        eval_loader=DataLoader(splits["test"], batch_size=batch_size),
+        epochs=epochs,
+    )
+    manager.save(f"ckpts/{student_name}")
+
+    # Correlation retained and CPU speedup on held-out rating data, the last 20%
+    # like in sweep.py, as the teacher was fine-tuned on the rest
+    ratings = DialogRatingDataset(root="data/ratings", dataset="ratings")
+    held_out = Subset(ratings, range(int(len(ratings) * 0.80), len(ratings)))
+    batches = list(DataLoader(held_out, batch_size=batch_size))
+    targets = torch.cat([batch.y for batch in batches]).view(-1, 4).numpy()
+    teacher_preds, teacher_time = timed_eval(teacher_model, batches, n_timing_runs)
+    student_preds, student_time = timed_eval(student, batches, n_timing_runs)
+
+    teacher_corrs = pearson(teacher_preds, targets)
+    student_corrs = pearson(student_preds, targets)
+    agreement = pearson(student_preds, teacher_preds)
+
+    print(f"Speedup on CPU: {teacher_time / student_time:.1f}x")
+    for i, dimension in enumerate(DIMENSIONS):
+        line = (
+            f"{dimension}: teacher r={teacher_corrs[i]:.3f}, "
+            f"student r={student_corrs[i]:.3f}, "
+            f"agreement r={agreement[i]:.3f}"
+        )
+        # The ratio is meaningless when the teacher barely correlates
+        if abs(teacher_corrs[i]) >= min_teacher_r:
+            line += f", retained={student_corrs[i] / teacher_corrs[i]:.1%}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import copy
+import queue
+import traceback
+
+import torch.multiprocessing as mp
+
+from checkpoint_writer import cpu_state_dict
+from utils import get_torch_device, load_model_state_dict
+
+
+def _run(model, criterion, eval_loader, device, adapter_only, tasks, results):
+    # Imported here to avoid a circular import with model_manager
+    from model_manager import ModelManager
+
+    manager = ModelManager(model, None, criterion=criterion, device=device)
+    model.to(device)
+
+    while True:
+        item = tasks.get()
+        if item is None:
+            return
+
+        epoch, state_dict = item
+        try:
+            load_model_state_dict(model, state_dict, adapter_only)
+            eval_target, eval_preds = manager.eval(eval_loader)
+            eval_loss = criterion(eval_preds, eval_target).item()
+            results.put((epoch, eval_target, eval_preds, eval_loss, None))
+        except Exception:
+            results.put((epoch, None, None, None, traceback.format_exc()))
+
+
+class EvalWorker:
+    """Evaluates epoch snapshots in a separate process while training continues.
+
+    At most `max_pending` snapshots wait for evaluation, `submit` blocks until
+    the worker catches up once that many are queued.
+    """
+
+    def __init__(
+        self,
+        model,
+        criterion,
+        eval_loader,
+        device=get_torch_device(),
+        adapter_only=False,
+        max_pending=1,
+    ):
+        ctx = mp.get_context("spawn")
+        self.tasks = ctx.Queue(maxsize=max_pending)
+        self.results = ctx.Queue()
+        self.pending = 0
+
+        # A CPU copy, so the worker never shares memory with the weights in training
+        self.process = ctx.Process(
+            target=_run,
+            args=(
+                copy.deepcopy(model).cpu(),
+                criterion,
+                eval_loader,
+                device,
+                adapter_only,
+                self.tasks,
+                self.results,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+
+    def submit(self, epoch, state_dict):
+        state_dict = cpu_state_dict(state_dict)
+        while True:
+            try:
+                self.tasks.put((epoch, state_dict), timeout=1)
+                break
+            except queue.Full:
+                self._check_alive()
+        self.pending += 1
+
+    def poll(self):
+        """Finished `(epoch, eval_target, eval_preds, eval_loss)` results, if any."""
+        finished = []
+        while self.pending:
+            try:
+                finished.append(self._result(self.results.get_nowait()))
+            except queue.Empty:
+                break
+        return finished
+
+    def close(self):
+        """Waits for the remaining evaluations and stops the worker."""
+        finished = []
+        while self.pending:
+            try:
+                finished.append(self._result(self.results.get(timeout=1)))
+            except queue.Empty:
+                self._check_alive()
+
+        self.tasks.put(None)
+        self.process.join()
+        return finished
+
+    def stop(self):
+        """Stops the worker without waiting for pending evaluations."""
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+
+    def _check_alive(self):
+        if not self.process.is_alive():
+            raise RuntimeError(
+                f"Evaluation worker exited unexpectedly ({self.process.exitcode})"
+            )
+
+    def _result(self, result):
+        self.pending -= 1
+        epoch, eval_target, eval_preds, eval_loss, error = result
+        if error is not None:
+            raise RuntimeError(f"Evaluating epoch {epoch} failed:\n{error}")
+        return epoch, eval_target, eval_preds, eval_loss
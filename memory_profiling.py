@@ -1,3 +1,6 @@
+import io
+import time
+
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -7,6 +10,7 @@ from torch_geometric.loader import DataLoader
 from dialog_discrimination_dataset import DialogDiscriminationDataset
 from model.dialog_discriminator import DialogDiscriminator
 from model_manager import HingeLoss
+from utils import optimizer_state_size, trainable_state_dict
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
@@ -60,8 +64,65 @@ def check_mem_usage():
     print(f"Current memory usage: {current_memory:.2f} MB")
 
 
-print("With mixed precision:")
-check_mem_usage_mixed_precision()
-
-print("\nWithout mixed precision:")
-check_mem_usage()
+def profile_fine_tuning_mode(use_lora, n_steps=5):
+    """Optimizer memory, step time and checkpoint size for one training mode."""
+    mode_model = DialogDiscriminator(use_lora=use_lora).to(device)
+    mode_optimizer = optim.Adam(
+        [p for p in mode_model.parameters() if p.requires_grad], lr=0.0001
+    )
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats()
+
+    step_times = []
+    for _ in range(n_steps):
+        start = time.perf_counter()
+        output = mode_model(input_data)
+        loss = criterion(output, target)
+        mode_optimizer.zero_grad()
+        loss.backward()
+        mode_optimizer.step()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        step_times.append(time.perf_counter() - start)
+
+    state_dict = (
+        trainable_state_dict(mode_model) if use_lora else mode_model.state_dict()
+    )
+    checkpoint = io.BytesIO()
+    torch.save(state_dict, checkpoint)
+
+    return {
+        "optimizer_mb": optimizer_state_size(mode_optimizer) / (1024**2),
+        # The first step includes allocator and kernel warm-up
+        "step_s": sum(step_times[1:]) / max(len(step_times) - 1, 1),
+        "checkpoint_mb": checkpoint.getbuffer().nbytes / (1024**2),
+        "peak_mb": (
+            torch.cuda.max_memory_allocated(device) / (1024**2)
+            if device.type == "cuda"
+            else float("nan")
+        ),
+    }
+
+
+def compare_fine_tuning_modes():
+    print("\nFull fine-tuning vs. LoRA:")
+    full = profile_fine_tuning_mode(use_lora=False)
+    lora = profile_fine_tuning_mode(use_lora=True)
+    for key in full:
+        print(f"{key}: full={full[key]:.3f}, lora={lora[key]:.3f}")
+
+
+if __name__ == "__main__":
+    # The baseline measurements only work on CUDA
+    if device.type == "cuda":
+        print("With mixed precision:")
+        check_mem_usage_mixed_precision()
+
+        print("\nWithout mixed precision:")
+        check_mem_usage()
+
+    # Free the baseline model and its Adam state, so the peak memory of each mode
+    # doesn't include an extra full model
+    del model, optimizer
+    compare_fine_tuning_modes()
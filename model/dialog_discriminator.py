@@ -12,6 +12,7 @@ class DialogDiscriminator(nn.Module):
         embed_dim=384,
         graph_hidden_dim=384,
         graph_out_dim=10,
+        use_lora=False,
     ):
         super(DialogDiscriminator, self).__init__()
 
@@ -21,6 +22,7 @@ class DialogDiscriminator(nn.Module):
             embed_dim=embed_dim,
             hidden_dim=graph_hidden_dim,
             out_dim=graph_out_dim,
+            use_lora=use_lora,
         )
         self.lin = nn.Linear(2 * graph_out_dim, 1)
 
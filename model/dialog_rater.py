@@ -22,6 +22,8 @@ class DialogRater(nn.Module):
         n_dimensions=4,
         n_hidden_layers=1,
         hidden_dim=50,
+        use_lora=False,
+        utterance_embedding=None,
     ):
         super(DialogRater, self).__init__()
 
@@ -31,6 +33,8 @@ class DialogRater(nn.Module):
             embed_dim=embed_dim,
             hidden_dim=graph_hidden_size,
             out_dim=graph_out_dim,
+            use_lora=use_lora,
+            utterance_embedding=utterance_embedding,
         )
         self.bn = nn.BatchNorm1d(graph_out_dim)
 
@@ -11,11 +11,24 @@ def pairwise_cosine_similarity(x):
 
 
 class GraphEmbedding(nn.Module):
-    def __init__(self, n_layers, n_relations, embed_dim, hidden_dim, out_dim):
+    def __init__(
+        self,
+        n_layers,
+        n_relations,
+        embed_dim,
+        hidden_dim,
+        out_dim,
+        use_lora=False,
+        utterance_embedding=None,
+    ):
         super(GraphEmbedding, self).__init__()
 
         self.n_layers = n_layers
-        self.embed = UtteranceEmbedding(embed_dim=embed_dim)
+        self.embed = (
+            utterance_embedding
+            if utterance_embedding is not None
+            else UtteranceEmbedding(embed_dim=embed_dim, use_lora=use_lora)
+        )
 
         relation_aware_mps = []
         mps = []
@@ -33,6 +46,12 @@ class GraphEmbedding(nn.Module):
 
         self.relation_aware_mps = nn.ModuleList(relation_aware_mps)
         self.mps = nn.ModuleList(mps)
+        # The first residual connection goes from embed_dim to hidden_dim
+        self.residual_proj = (
+            nn.Linear(embed_dim, hidden_dim)
+            if n_layers > 0 and embed_dim != hidden_dim
+            else nn.Identity()
+        )
         self.lin = nn.Linear(hidden_dim, out_dim)
         self.do = nn.Dropout(0.5)
 
@@ -50,7 +69,7 @@ class GraphEmbedding(nn.Module):
                     self.relation_aware_mps[i](x, edge_index, edge_weights, edge_type),
                     edge_index,
                 )
-            ) + x
+            ) + (self.residual_proj(x) if i == 0 else x)
             x = self.do(x)
 
         # Aggregate to graph level
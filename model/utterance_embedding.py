@@ -2,25 +2,36 @@ import torch.nn as nn
 from peft import LoraConfig, TaskType, get_peft_model
 from transformers import AutoModel
 
+PRETRAINED_ENCODER = "sentence-transformers/paraphrase-MiniLM-L6-v2"
+
 
 class UtteranceEmbedding(nn.Module):
-    """Embeds dialog utterances into a fixed-size vector."""
+    """Embeds dialog utterances into a fixed-size vector.
+
+    With `use_lora` the pre-trained encoder is frozen and only LoRA adapters on
+    the attention projections are trained. `n_encoder_layers` keeps only the first
+    transformer layers, e.g. for a cheaper distilled student.
+    """
 
-    def __init__(self, embed_dim):
+    def __init__(self, embed_dim, use_lora=False, n_encoder_layers=None):
         super(UtteranceEmbedding, self).__init__()
 
-        peft_config = LoraConfig(
-            task_type=TaskType.FEATURE_EXTRACTION,
-            inference_mode=False,
-            r=8,
-            lora_alpha=32,
-            lora_dropout=0.1,
-            target_modules=["query", "key", "value"],
-        )
-        model = AutoModel.from_pretrained(
-            "sentence-transformers/paraphrase-MiniLM-L6-v2"
-        )
-        self.model = model  # get_peft_model(model, peft_config)
+        model = AutoModel.from_pretrained(PRETRAINED_ENCODER)
+        if n_encoder_layers is not None:
+            model.encoder.layer = model.encoder.layer[:n_encoder_layers]
+            model.config.num_hidden_layers = n_encoder_layers
+        if use_lora:
+            peft_config = LoraConfig(
+                task_type=TaskType.FEATURE_EXTRACTION,
+                inference_mode=False,
+                r=8,
+                lora_alpha=32,
+                lora_dropout=0.1,
+                target_modules=["query", "key", "value"],
+            )
+            model = get_peft_model(model, peft_config)
+
+        self.model = model
         self.bn = nn.BatchNorm1d(embed_dim)
 
     def forward(self, x):
@@ -30,3 +41,28 @@ class UtteranceEmbedding(nn.Module):
             :, 0, :
         ]  # Index 0 for the [CLS] token in each sequence
         return self.bn(embeddings)
+
+
+class StaticUtteranceEmbedding(nn.Module):
+    """Embeds utterances as the mean of their static token embeddings.
+
+    No transformer layers are run, which makes it much cheaper than
+    `UtteranceEmbedding`. The token embeddings start from the encoder's input
+    embedding table, or from `token_embeddings` when given.
+    """
+
+    def __init__(self, embed_dim, token_embeddings=None):
+        super(StaticUtteranceEmbedding, self).__init__()
+
+        if token_embeddings is None:
+            model = AutoModel.from_pretrained(PRETRAINED_ENCODER)
+            token_embeddings = model.get_input_embeddings().weight.detach().clone()
+
+        self.token_embed = nn.EmbeddingBag.from_pretrained(
+            token_embeddings, freeze=False, mode="mean", padding_idx=0
+        )
+        self.lin = nn.Linear(token_embeddings.size(1), embed_dim)
+        self.bn = nn.BatchNorm1d(embed_dim)
+
+    def forward(self, x):
+        return self.bn(self.lin(self.token_embed(x)))
@@ -5,7 +5,10 @@ import torch.nn as nn
 from torch import Tensor
 from tqdm import tqdm
 
-from utils import get_torch_device
+from checkpoint_writer import CheckpointWriter
+from eval_worker import EvalWorker
+from prediction_log import PredictionLog
+from utils import get_torch_device, load_model_state_dict, trainable_state_dict
 
 
 class MultiDimensionMSELoss(nn.Module):
@@ -42,6 +45,7 @@ class ModelManager(nn.Module):
         model_base_name="",
         criterion=HingeLoss(),
         device=get_torch_device(),
+        adapter_only=False,
     ):
         super().__init__()
         self.model = model
@@ -50,12 +54,22 @@ class ModelManager(nn.Module):
         self.device = device
         self.model_base_path = model_base_name.split(".")[0]
         self.model_name = self.model_base_path.split("/")[-1]
+        # Adapter-only checkpoints leave out the frozen base encoder weights,
+        # which are restored from the shared pre-trained model instead.
+        self.adapter_only = adapter_only
+
+    def model_state_dict(self):
+        return (
+            trainable_state_dict(self.model)
+            if self.adapter_only
+            else self.model.state_dict()
+        )
 
     def save(self, path):
-        torch.save(self.model.state_dict(), path)
+        torch.save(self.model_state_dict(), path)
 
     def load(self, path):
-        self.model.load_state_dict(torch.load(path))
+        load_model_state_dict(self.model, torch.load(path), self.adapter_only)
 
     def train(
         self,
@@ -67,57 +81,157 @@ class ModelManager(nn.Module):
         batch_size=None,
         num_classes=None,
         output_path="./output",
+        keep_last_n=None,
+        keep_best=False,
+        epoch_callback=None,
+        async_eval=False,
+        max_pending_evals=1,
+        eval_device=None,
     ):
-        self.model.train()
+        """Trains for `epochs` epochs, evaluating on `eval_loader` after each one.
 
-        for epoch in range(epochs):
-            target, pred = [], []
-            batch_losses = []
-            progress_bar = tqdm(
-                enumerate(train_loader),
-                total=len(train_loader),
-                desc=f"Epoch {epoch + 1}/{epochs}",
-                leave=True,
+        `epoch_callback(epoch, train_loss, eval_loss)` is called once an epoch has
+        been evaluated, and training stops early if it returns True. With
+        `async_eval` the evaluation runs in a separate process while the next epoch
+        trains, so the callback may run a few epochs late. It runs on `self.device`
+        unless `eval_device` is given, e.g. the CPU to save GPU memory, which can
+        change the results by rounding.
+        """
+        checkpoint_writer = (
+            CheckpointWriter(
+                keep_last_n=keep_last_n, keep_best=keep_best and bool(eval_loader)
+            )
+            if save_every_epoch
+            else None
+        )
+        prediction_log = PredictionLog(
+            f"{output_path}/{self.model_name}_predictions", mode="w"
+        )
+        eval_worker = (
+            EvalWorker(
+                self.model,
+                self.criterion,
+                eval_loader,
+                eval_device or self.device,
+                adapter_only=self.adapter_only,
+                max_pending=max_pending_evals,
             )
+            if async_eval and eval_loader
+            else None
+        )
 
-            for batch in train_loader:
-                batch = batch.to(self.device)
-                self.optimizer.zero_grad()
+        train_losses = {}
+        stop = False
 
-                out = self.model(batch)
-                loss = self.criterion(out, batch.y)
-                loss.backward()
-                self.optimizer.step()
+        try:
 
-                target.extend(batch.y.cpu().detach().numpy())
-                pred.extend(out.cpu().detach().numpy())
+            for epoch in range(epochs):
+                # Evaluation switches the model to eval mode
+                self.model.train()
 
-                batch_losses.append(loss.item())
+                target, pred = [], []
+                batch_losses = []
+                progress_bar = tqdm(
+                    enumerate(train_loader),
+                    total=len(train_loader),
+                    desc=f"Epoch {epoch + 1}/{epochs}",
+                    leave=True,
+                )
 
-                progress_bar.update(1)
-                progress_bar.set_postfix(
-                    epoch=mean(batch_losses),
-                    window=mean(batch_losses[-loss_window:]),
+                for batch in train_loader:
+                    batch = batch.to(self.device)
+                    self.optimizer.zero_grad()
+
+                    out = self.model(batch)
+                    loss = self.criterion(out, batch.y)
+                    loss.backward()
+                    self.optimizer.step()
+
+                    target.extend(batch.y.cpu().detach().numpy())
+                    pred.extend(out.cpu().detach().numpy())
+
+                    batch_losses.append(loss.item())
+
+                    progress_bar.update(1)
+                    progress_bar.set_postfix(
+                        epoch=mean(batch_losses),
+                        window=mean(batch_losses[-loss_window:]),
+                    )
+
+                progress_bar.close()
+
+                train_losses[epoch + 1] = mean(batch_losses)
+                prediction_log.append(
+                    epoch + 1, train_target=Tensor(target), train_preds=Tensor(pred)
                 )
+                if checkpoint_writer:
+                    checkpoint_writer.save(
+                        self.checkpoint_path(epoch + 1), self.model_state_dict()
+                    )
 
-            progress_bar.close()
+                if eval_worker:
+                    eval_worker.submit(epoch + 1, self.model_state_dict())
+                    eval_results = eval_worker.poll()
+                elif eval_loader:
+                    # Iterating the loader draws from the global RNG, keep it out of the
+                    # training stream so sync and async evaluation train identically
+                    with torch.random.fork_rng(devices=[]):
+                        eval_target, eval_preds = self.eval(eval_loader)
+                    eval_loss = self.criterion(eval_preds, eval_target).item()
+                    eval_results = [(epoch + 1, eval_target, eval_preds, eval_loss)]
+                else:
+                    eval_results = [(epoch + 1, None, None, None)]
 
-            if save_every_epoch:
-                self.save(self.model_base_path + f"_epoch={epoch+1}.pth")
+                for eval_result in eval_results:
+                    if self.finish_epoch(
+                        eval_result,
+                        train_losses,
+                        checkpoint_writer,
+                        prediction_log,
+                        epoch_callback,
+                    ):
+                        stop = True
+                if stop:
+                    break
 
-            eval_target, eval_preds = None, None
-            if eval_loader:
-                eval_target, eval_preds = self.eval(eval_loader)
+            if eval_worker:
+                for eval_result in eval_worker.close():
+                    self.finish_epoch(
+                        eval_result,
+                        train_losses,
+                        checkpoint_writer,
+                        prediction_log,
+                        epoch_callback,
+                    )
+        finally:
+            # Runs on errors too, so queued checkpoints still reach the disk and the
+            # eval worker doesn't outlive training
+            if eval_worker:
+                eval_worker.stop()
+            if checkpoint_writer:
+                checkpoint_writer.close()
 
-            epoch_data = {
-                "train_target": Tensor(target),
-                "train_preds": Tensor(pred),
-                "eval_target": eval_target,
-                "eval_preds": eval_preds,
-            }
-            torch.save(
-                epoch_data, f"{output_path}/{self.model_name}_epoch={epoch + 1}.pt"
-            )
+    def checkpoint_path(self, epoch):
+        return self.model_base_path + f"_epoch={epoch}.pth"
+
+    def finish_epoch(
+        self,
+        eval_result,
+        train_losses,
+        checkpoint_writer,
+        prediction_log,
+        epoch_callback,
+    ):
+        """Records an epoch's evaluation and returns whether training should stop."""
+        epoch, eval_target, eval_preds, eval_loss = eval_result
+
+        if checkpoint_writer and eval_loss is not None:
+            checkpoint_writer.set_score(self.checkpoint_path(epoch), eval_loss)
+        prediction_log.append(epoch, eval_target=eval_target, eval_preds=eval_preds)
+
+        return bool(
+            epoch_callback and epoch_callback(epoch, train_losses[epoch], eval_loss)
+        )
 
     def eval(self, loader, loss_window=10):
         self.model.eval()
@@ -8,7 +8,7 @@ from torch_geometric.loader import DataLoader
 from dialog_discrimination_dataset import DialogDiscriminationDataset
 from model.dialog_discriminator import DialogDiscriminator
 from model_manager import ModelManager
-from utils import get_file_names, get_torch_device
+from utils import get_file_names, get_torch_device, print_model_parameters
 
 
 @click.command()
@@ -19,6 +19,27 @@ from utils import get_file_names, get_torch_device
 @click.option("--n_training_points", type=int, help="Number of training points")
 @click.option("--n_layers", default=1, type=int, help="Number of layers")
 @click.option("--graph_out_dim", default=10, type=int, help="Graph output dimension")
+@click.option(
+    "--lora",
+    is_flag=True,
+    help="Train LoRA adapters on a frozen encoder and save adapter-only checkpoints",
+)
+@click.option(
+    "--keep_last_n", type=int, help="Number of most recent epoch checkpoints to keep"
+)
+@click.option(
+    "--keep_best", is_flag=True, help="Keep the epoch checkpoint with lowest eval loss"
+)
+@click.option(
+    "--async_eval",
+    is_flag=True,
+    help="Evaluate each epoch in a background process while training continues",
+)
+@click.option(
+    "--eval_device",
+    help="Device for the background evaluation, e.g. cpu. Defaults to the training "
+    "device, which keeps the results the same as synchronous evaluation",
+)
 def main(
     mode: str,
     lr: float,
@@ -27,9 +48,14 @@ def main(
     n_training_points: int,
     n_layers: int,
     graph_out_dim: int,
+    lora: bool,
+    keep_last_n: int,
+    keep_best: bool,
+    async_eval: bool,
+    eval_device: str,
 ):
     log_name, model_name = get_file_names(
-        lr, epochs, batch_size, n_training_points, n_layers, graph_out_dim
+        lr, epochs, batch_size, n_training_points, n_layers, graph_out_dim, lora
     )
     log_file = open(
         f"logs/{mode}/{log_name}",
@@ -39,15 +65,20 @@ def main(
 
     device = get_torch_device()
 
-    model = DialogDiscriminator(n_graph_layers=n_layers, graph_out_dim=graph_out_dim)
+    model = DialogDiscriminator(
+        n_graph_layers=n_layers, graph_out_dim=graph_out_dim, use_lora=lora
+    )
     model.to(device)
+    print_model_parameters(model)
 
     dataset = "twitter_cs"
     root = f"data/{dataset}"
     model_path = f"ckpts/{model_name}"
 
-    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
-    manager = ModelManager(model, optimizer, "ckpts/" + model_name)
+    optimizer = torch.optim.Adam(
+        [p for p in model.parameters() if p.requires_grad], lr=lr
+    )
+    manager = ModelManager(model, optimizer, "ckpts/" + model_name, adapter_only=lora)
 
     train_data = DialogDiscriminationDataset(root=root, dataset=dataset, split="train")
     train_data = (
@@ -69,6 +100,10 @@ def main(
             train_loader=train_loader,
             eval_loader=eval_loader,
             save_every_epoch=True,
+            keep_last_n=keep_last_n,
+            keep_best=keep_best,
+            async_eval=async_eval,
+            eval_device=torch.device(eval_device) if eval_device else None,
         )
         manager.save(model_path)
     elif mode == "eval":
@@ -0,0 +1,82 @@
+import json
+import os
+
+import numpy as np
+import torch
+
+
+class PredictionLog:
+    """Appends per-epoch prediction tensors to a single float32 file.
+
+    An index file next to the data records the offset and shape of every array, so
+    single epochs can be read back as memory-mapped arrays without loading the run.
+    """
+
+    def __init__(self, path, mode="r"):
+        self.data_path = f"{path}.bin"
+        self.index_path = f"{path}.json"
+
+        if mode == "w":
+            open(self.data_path, "wb").close()
+            self.index = []
+            self._write_index()
+        else:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    def append(self, epoch, **tensors):
+        with open(self.data_path, "ab") as f:
+            f.seek(0, os.SEEK_END)
+            for name, tensor in tensors.items():
+                if tensor is None:
+                    continue
+
+                array = np.ascontiguousarray(
+                    torch.as_tensor(tensor).cpu().numpy(), dtype=np.float32
+                )
+                self.index.append(
+                    {
+                        "epoch": epoch,
+                        "name": name,
+                        "offset": f.tell(),
+                        "shape": list(array.shape),
+                    }
+                )
+                f.write(array.tobytes())
+
+        self._write_index()
+
+    def epochs(self):
+        return sorted({entry["epoch"] for entry in self.index})
+
+    def read(self, epoch, name):
+        entry = next(
+            (e for e in self.index if e["epoch"] == epoch and e["name"] == name), None
+        )
+        if entry is None:
+            return None
+
+        shape = tuple(entry["shape"])
+        if 0 in shape:
+            return np.empty(shape, dtype=np.float32)
+        return np.memmap(
+            self.data_path,
+            dtype=np.float32,
+            mode="r",
+            offset=entry["offset"],
+            shape=shape,
+        )
+
+    def epoch_data(self, epoch):
+        """The epoch's predictions in the layout of the old per-epoch `.pt` files."""
+        epoch_data = {}
+        for name in ["train_target", "train_preds", "eval_target", "eval_preds"]:
+            array = self.read(epoch, name)
+            epoch_data[name] = None if array is None else torch.tensor(np.array(array))
+        return epoch_data
+
+    def _write_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
@@ -0,0 +1,451 @@
+import itertools
+import json
+import os
+import queue
+import random
+import sqlite3
+import time
+import traceback
+from statistics import median
+
+import click
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import Subset
+from torch_geometric.loader import DataLoader
+
+from dialog_discrimination_dataset import DialogDiscriminationDataset
+from dialog_rating_dataset import DialogRatingDataset
+from model.dialog_discriminator import DialogDiscriminator
+from model.dialog_rater import DialogRater
+from model_manager import HingeLoss, ModelManager, MultiDimensionMSELoss
+from utils import get_torch_device, load_model_state_dict
+
+SEARCH_SPACE = {
+    "lr": float,
+    "n_layers": int,
+    "graph_out_dim": int,
+    "batch_size": int,
+    "graph_hidden_dim": int,
+    "hidden_dim": int,
+}
+
+RESULTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    sweep TEXT,
+    trial_id INTEGER,
+    task TEXT,
+    lr REAL,
+    n_layers INTEGER,
+    graph_out_dim INTEGER,
+    batch_size INTEGER,
+    graph_hidden_dim INTEGER,
+    hidden_dim INTEGER,
+    status TEXT,
+    epochs_run INTEGER,
+    best_eval_loss REAL,
+    final_eval_loss REAL,
+    eval_losses TEXT,
+    duration_s REAL,
+    error TEXT,
+    PRIMARY KEY (sweep, trial_id)
+)
+"""
+
+
+def grid_trials(space):
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*space.values())]
+
+
+def random_trials(space, n_trials, seed=None):
+    """Samples `n_trials` distinct configurations, or all of them if there are fewer."""
+    trials = grid_trials(space)
+    random.Random(seed).shuffle(trials)
+    return trials[:n_trials]
+
+
+def invalid_params(params, pretrained_sizes=None):
+    """Reasons why a configuration can't be trained, checked before it is queued."""
+    reasons = []
+    if params["lr"] <= 0:
+        reasons.append("lr must be positive")
+    for name in params:
+        if name != "lr" and params[name] < 1:
+            reasons.append(f"{name} must be at least 1")
+    for name, size in (pretrained_sizes or {}).items():
+        if params[name] != size:
+            reasons.append(f"{name} must be {size} to load the pre-trained model")
+    return reasons
+
+
+def pretrained_sizes(state_dict):
+    """Graph embedding sizes of a pre-trained `DialogDiscriminator` state dict."""
+    out_dim, hidden_dim = state_dict["graph_embed.lin.weight"].shape
+    n_layers = len(
+        {k.split(".")[2] for k in state_dict if k.startswith("graph_embed.mps.")}
+    )
+    return {
+        "n_layers": n_layers,
+        "graph_hidden_dim": hidden_dim,
+        "graph_out_dim": out_dim,
+    }
+
+
+def share_dataset(dataset):
+    """Moves the dataset tensors to shared memory so workers don't get a copy each."""
+    dataset._data.apply(lambda t: t.share_memory_())
+    for key in dataset.slices:
+        dataset.slices[key].share_memory_()
+    return dataset
+
+
+def load_datasets(task, n_training_points=None):
+    if task == "pretrain":
+        dataset = "twitter_cs"
+        root = f"data/{dataset}"
+        train_data = share_dataset(
+            DialogDiscriminationDataset(root=root, dataset=dataset, split="train")
+        )
+        eval_data = share_dataset(
+            DialogDiscriminationDataset(root=root, dataset=dataset, split="test")
+        )
+        train_idxs, eval_idxs = range(len(train_data)), range(len(eval_data))
+    else:
+        dataset = "ratings"
+        root = f"data/{dataset}"
+        train_data = eval_data = share_dataset(
+            DialogRatingDataset(root=root, dataset=dataset)
+        )
+        n_train = int(len(train_data) * 0.80)
+        train_idxs, eval_idxs = range(n_train), range(n_train, len(train_data))
+
+    if n_training_points:
+        train_idxs = train_idxs[:n_training_points]
+        eval_idxs = eval_idxs[:n_training_points]
+
+    return Subset(train_data, train_idxs), Subset(eval_data, eval_idxs)
+
+
+def build_model(task, params, pretrained=None):
+    if task == "pretrain":
+        return DialogDiscriminator(
+            n_graph_layers=params["n_layers"],
+            graph_hidden_dim=params["graph_hidden_dim"],
+            graph_out_dim=params["graph_out_dim"],
+        )
+    model = DialogRater(
+        n_graph_layers=params["n_layers"],
+        graph_hidden_size=params["graph_hidden_dim"],
+        graph_out_dim=params["graph_out_dim"],
+        hidden_dim=params["hidden_dim"],
+    )
+    if pretrained:
+        # Start from the pre-trained graph embedding, like bootstrap_corr_test.py
+        state_dict = torch.load(pretrained, map_location="cpu")
+        load_model_state_dict(
+            model.graph_embed,
+            {
+                k.replace("graph_embed.", ""): v
+                for k, v in state_dict.items()
+                if "graph_embed" in k
+            },
+        )
+    return model
+
+
+class MedianStoppingRule:
+    """Stops a trial whose eval loss is worse than the median of the other trials.
+
+    Eval losses are shared between the worker processes, so a trial is compared to
+    every other trial that has reached the same epoch.
+    """
+
+    def __init__(self, history, lock, min_epochs=1, min_trials=3):
+        self.history = history
+        self.lock = lock
+        self.min_epochs = min_epochs
+        self.min_trials = min_trials
+
+    def __call__(self, epoch, eval_loss):
+        with self.lock:
+            losses = self.history.get(epoch, [])
+            self.history[epoch] = losses + [eval_loss]
+
+        return (
+            epoch >= self.min_epochs
+            and len(losses) >= self.min_trials
+            and eval_loss > median(losses)
+        )
+
+
+def run_trial(
+    sweep_name, task, trial_id, params, datasets, epochs, stopping_rule, pretrained
+):
+    train_data, eval_data = datasets
+    device = get_torch_device()
+
+    model = build_model(task, params, pretrained)
+    model.to(device)
+    optimizer = torch.optim.Adam(model.parameters(), lr=params["lr"])
+    criterion = (
+        HingeLoss() if task == "pretrain" else MultiDimensionMSELoss(num_classes=4)
+    )
+    manager = ModelManager(
+        model,
+        optimizer,
+        f"ckpts/{sweep_name}_trial={trial_id}",
+        criterion=criterion,
+        device=device,
+    )
+
+    train_loader = DataLoader(train_data, batch_size=params["batch_size"], shuffle=True)
+    eval_loader = DataLoader(eval_data, batch_size=params["batch_size"])
+
+    eval_losses = []
+    stopped = False
+
+    def on_epoch(epoch, train_loss, eval_loss):
+        nonlocal stopped
+        eval_losses.append(eval_loss)
+        stopped = stopping_rule(epoch, eval_loss) and epoch < epochs
+        return stopped
+
+    manager.train(
+        train_loader,
+        eval_loader,
+        epochs,
+        output_path=f"output/{sweep_name}",
+        epoch_callback=on_epoch,
+    )
+
+    return {
+        "status": "stopped" if stopped else "completed",
+        "epochs_run": len(eval_losses),
+        "best_eval_loss": min(eval_losses),
+        "final_eval_loss": eval_losses[-1],
+        "eval_losses": json.dumps(eval_losses),
+    }
+
+
+def worker(
+    worker_id,
+    sweep_name,
+    task,
+    datasets,
+    epochs,
+    stopping_rule,
+    pretrained,
+    trials,
+    in_flight,
+    results,
+):
+    while True:
+        item = trials.get()
+        if item is None:
+            return
+
+        trial_id, params = item
+        # Lets the main process fail the trial if this worker gets killed
+        in_flight[worker_id] = item
+        start = time.perf_counter()
+        try:
+            result = run_trial(
+                sweep_name,
+                task,
+                trial_id,
+                params,
+                datasets,
+                epochs,
+                stopping_rule,
+                pretrained,
+            )
+        except Exception:
+            result = {"status": "failed", "error": traceback.format_exc()}
+        result["duration_s"] = time.perf_counter() - start
+        results.put((trial_id, params, result))
+
+
+def save_result(db, sweep_name, task, trial_id, params, result):
+    row = {"sweep": sweep_name, "trial_id": trial_id, "task": task}
+    row.update(params)
+    row.update(result)
+    columns = ", ".join(row)
+    placeholders = ", ".join("?" for _ in row)
+    db.execute(
+        f"INSERT OR REPLACE INTO trials ({columns}) VALUES ({placeholders})",
+        list(row.values()),
+    )
+    db.commit()
+
+
+def parse_values(values, cast):
+    return [cast(v) for v in values.split(",")]
+
+
+@click.command()
+@click.option("--task", type=click.Choice(["pretrain", "rating"]), default="rating")
+@click.option(
+    "--search",
+    type=click.Choice(["grid", "random"]),
+    default="grid",
+    help="Run every configuration of the grid, or a random subset of it",
+)
+@click.option(
+    "--n_trials",
+    default=10,
+    type=int,
+    help="Trials for random search, sampled without replacement from the grid",
+)
+@click.option("--seed", type=int, help="Seed for random search")
+@click.option("--lr", default="0.001,0.0001", help="Comma separated learning rates")
+@click.option("--n_layers", default="1,2", help="Comma separated number of layers")
+@click.option("--graph_out_dim", default="10", help="Comma separated graph out dims")
+@click.option("--batch_size", default="10", help="Comma separated batch sizes")
+@click.option(
+    "--graph_hidden_dim", default="384", help="Comma separated graph hidden dims"
+)
+@click.option(
+    "--hidden_dim",
+    default="50",
+    help="Comma separated rater hidden dims, unused when pre-training",
+)
+@click.option(
+    "--pretrained",
+    help="DialogDiscriminator state dict to start rating trials from. Without it the "
+    "rating trials train from scratch, unlike the fine-tuning in "
+    "bootstrap_corr_test.py. Its n_layers, graph_hidden_dim and graph_out_dim must "
+    "match the swept values",
+)
+@click.option("--epochs", default=10, type=int, help="Number of epochs per trial")
+@click.option("--n_workers", default=2, type=int, help="Number of worker processes")
+@click.option(
+    "--min_epochs", default=2, type=int, help="Epochs before a trial can be stopped"
+)
+@click.option("--n_training_points", type=int, help="Number of training points")
+@click.option("--results_db", default="output/sweeps.db", help="SQLite results file")
+@click.option("--sweep_name", help="Name of the sweep in the results table")
+def main(
+    task,
+    search,
+    n_trials,
+    seed,
+    epochs,
+    n_workers,
+    min_epochs,
+    n_training_points,
+    results_db,
+    sweep_name,
+    pretrained,
+    **values,
+):
+    """Trains every trial configuration and records the results in `results_db`.
+
+    Random search samples from the values given for the grid, it doesn't sample
+    from ranges.
+    """
+    space = {
+        name: parse_values(values[name], cast) for name, cast in SEARCH_SPACE.items()
+    }
+    if task == "pretrain":
+        # DialogDiscriminator has no rater head, so this would only repeat trials
+        del space["hidden_dim"]
+        if pretrained:
+            raise click.UsageError("--pretrained only applies to the rating task")
+
+    sizes = (
+        pretrained_sizes(torch.load(pretrained, map_location="cpu"))
+        if pretrained
+        else None
+    )
+    trials = (
+        grid_trials(space) if search == "grid" else random_trials(space, n_trials, seed)
+    )
+    for params in trials:
+        reasons = invalid_params(params, sizes)
+        if reasons:
+            raise click.UsageError(f"Invalid configuration {params}: {reasons}")
+    sweep_name = sweep_name or f"sweep_{int(time.time())}"
+    os.makedirs(f"output/{sweep_name}", exist_ok=True)
+
+    db = sqlite3.connect(results_db)
+    db.execute(RESULTS_SCHEMA)
+
+    ctx = mp.get_context("spawn")
+    sync_manager = ctx.Manager()
+    stopping_rule = MedianStoppingRule(
+        sync_manager.dict(), sync_manager.Lock(), min_epochs=min_epochs
+    )
+
+    # Loaded once, the workers only receive handles to the shared memory
+    datasets = load_datasets(task, n_training_points)
+
+    # Results and in-flight trials go through the manager, whose writes are done
+    # once they return. A process queue buffers them in a thread that dies with a
+    # killed worker.
+    trial_queue, result_queue = ctx.Queue(), sync_manager.Queue()
+    in_flight = sync_manager.dict()
+    for trial in enumerate(trials):
+        trial_queue.put(trial)
+    for _ in range(n_workers):
+        trial_queue.put(None)
+
+    workers = [
+        ctx.Process(
+            target=worker,
+            args=(
+                worker_id,
+                sweep_name,
+                task,
+                datasets,
+                epochs,
+                stopping_rule,
+                pretrained,
+                trial_queue,
+                in_flight,
+                result_queue,
+            ),
+        )
+        for worker_id in range(n_workers)
+    ]
+    for process in workers:
+        process.start()
+
+    remaining = set(range(len(trials)))
+    while remaining:
+        try:
+            trial_id, params, result = result_queue.get(timeout=5)
+        except queue.Empty:
+            # A worker killed by e.g. the OOM killer never reports its trial
+            for worker_id, process in enumerate(workers):
+                trial = in_flight.get(worker_id)
+                if process.exitcode in (None, 0) or trial is None:
+                    continue
+                trial_id, params = trial
+                if trial_id in remaining:
+                    remaining.remove(trial_id)
+                    result = {
+                        "status": "failed",
+                        "error": f"Worker exited unexpectedly ({process.exitcode})",
+                    }
+                    save_result(db, sweep_name, task, trial_id, params, result)
+                    print(f"Trial {trial_id} {result['status']}: {params}")
+
+            if remaining and not any(process.is_alive() for process in workers):
+                db.close()
+                raise click.ClickException(
+                    f"All workers exited, trials {sorted(remaining)} did not run"
+                )
+            continue
+
+        remaining.discard(trial_id)
+        save_result(db, sweep_name, task, trial_id, params, result)
+        print(f"Trial {trial_id} {result['status']}: {params}")
+
+    for process in workers:
+        process.join()
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import Dict, Tuple
 
 import torch
 
@@ -24,12 +24,52 @@ def get_file_names(
     n_training_points: int,
     n_layers: int,
     graph_out_dim: int,
+    lora: bool = False,
 ) -> Tuple[str, str]:
-    log_name = f"n_layers={n_layers}_lr={lr}_epochs={epochs}_batch_size={batch_size}_n_training_points={n_training_points}_graph_out_dim={graph_out_dim}.pth"
-    model_name = f"n_layers={n_layers}_graph_out_dim={graph_out_dim}.pth"
+    suffix = "_lora" if lora else ""
+    log_name = f"n_layers={n_layers}_lr={lr}_epochs={epochs}_batch_size={batch_size}_n_training_points={n_training_points}_graph_out_dim={graph_out_dim}{suffix}.pth"
+    model_name = f"n_layers={n_layers}_graph_out_dim={graph_out_dim}{suffix}.pth"
     return log_name, model_name
 
 
+def trainable_state_dict(model) -> Dict[str, torch.Tensor]:
+    """State dict without the frozen parameters, e.g. the base encoder in LoRA mode."""
+    frozen = {name for name, p in model.named_parameters() if not p.requires_grad}
+    return {k: v for k, v in model.state_dict().items() if k not in frozen}
+
+
+def load_model_state_dict(model, state_dict, adapter_only=False):
+    """Loads a state dict, which may leave out frozen parameters if `adapter_only`.
+
+    Adapter-only checkpoints can't be loaded strictly, so instead unexpected keys
+    and missing trainable parameters are rejected. That catches e.g. a full
+    checkpoint loaded into a LoRA model, whose keys would all be skipped otherwise.
+    """
+    if not adapter_only:
+        return model.load_state_dict(state_dict)
+
+    incompatible_keys = model.load_state_dict(state_dict, strict=False)
+    trainable = {name for name, p in model.named_parameters() if p.requires_grad}
+    missing_trainable = [k for k in incompatible_keys.missing_keys if k in trainable]
+    if incompatible_keys.unexpected_keys or missing_trainable:
+        raise RuntimeError(
+            "Checkpoint does not match the adapter model. "
+            f"Unexpected keys: {incompatible_keys.unexpected_keys[:5]}, "
+            f"missing trainable keys: {missing_trainable[:5]}"
+        )
+    return incompatible_keys
+
+
+def optimizer_state_size(optimizer) -> int:
+    """Number of bytes held by the optimizer state, e.g. Adam moments."""
+    return sum(
+        v.numel() * v.element_size()
+        for state in optimizer.state.values()
+        for v in state.values()
+        if torch.is_tensor(v)
+    )
+
+
 def print_model_parameters(model):
     total_params = sum(p.numel() for p in model.parameters())
     trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)